@@ -5,13 +5,12 @@
 Este script permite identificar y calcular el porcentaje de áreas con colores específicos
 (rojo, verde, amarillo) en una imagen. Para ello, crea máscaras en el espacio de color HSV,
 aplica la máscara a la imagen y calcula el área en píxeles de cada color para obtener un
-porcentaje. Finalmente, visualiza las áreas de cada color mediante matplotlib.
+porcentaje. Finalmente, visualiza las áreas de cada color en un mosaico con OpenCV.
 
 Requisitos:
 -----------
 - OpenCV
 - NumPy
-- Matplotlib
 
 Entradas:
 - Una imagen cargada desde el disco.
@@ -26,20 +25,40 @@ Created on Mon Oct 01 2024
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 
-def crear_mascara_de_color(image, suave_color, alto_color):
+LADO_MAXIMO_VISUALIZACION = 512  # Lado mayor en píxeles de las imágenes que se muestran
+ALTO_MAXIMO_MOSAICO = 900  # Alto inicial máximo en píxeles de la ventana del mosaico
+
+# Rangos de colores en el espacio HSV, creados una sola vez como arreglos uint8 contiguos
+SUAVE_ROJO_BAJO = np.array([0, 50, 50], dtype=np.uint8)
+ALTO_ROJO_BAJO = np.array([10, 255, 255], dtype=np.uint8)
+SUAVE_ROJO_ALTO = np.array([120, 50, 50], dtype=np.uint8)
+ALTO_ROJO_ALTO = np.array([180, 255, 255], dtype=np.uint8)
+SUAVE_VERDE = np.array([34, 50, 50], dtype=np.uint8)
+ALTO_VERDE = np.array([90, 255, 255], dtype=np.uint8)
+SUAVE_AMARILLO = np.array([11, 50, 50], dtype=np.uint8)
+ALTO_AMARILLO = np.array([33, 255, 255], dtype=np.uint8)
+
+# Tabla de colores a detectar: (nombre, lista de rangos (color inferior, color superior),
+# color BGR para la visualización). El rojo ocupa los dos extremos del tono, por lo que
+# usa dos rangos que se unen en una sola máscara.
+RANGOS_DE_COLOR = [
+    ('rojo', [(SUAVE_ROJO_BAJO, ALTO_ROJO_BAJO), (SUAVE_ROJO_ALTO, ALTO_ROJO_ALTO)], [0, 0, 255]),
+    ('verde', [(SUAVE_VERDE, ALTO_VERDE)], [0, 255, 0]),
+    ('amarillo', [(SUAVE_AMARILLO, ALTO_AMARILLO)], [0, 255, 255]),
+]
+
+def crear_mascara_de_color(cuadro_en_HSV, suave_color, alto_color):
     """ Crea una máscara para un rango de color especificado en una imagen dada.
 
     Parámetros:
-    - image (numpy.ndarray): La imagen en la cual se buscará el rango de color.
+    - cuadro_en_HSV (numpy.ndarray): La imagen, ya convertida a HSV, en la cual se buscará el rango de color.
     - suave_color (numpy.ndarray): Color inferior en el rango HSV.
     - alto_color (numpy.ndarray): Color superior en el rango HSV.
 
     Retorna:
     - numpy.ndarray: Máscara binaria donde los píxeles en el rango especificado son blancos (255) 
     y los demás son negros (0). """
-    cuadro_en_HSV = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)  # Convertir la imagen de BGR a HSV
     mascara = cv2.inRange(cuadro_en_HSV, suave_color, alto_color)  # Crear la máscara para el rango
     return mascara
 
@@ -49,11 +68,11 @@ def aplicacion_de_mascara(image, mascara, color):
     Parámetros:
     - image (numpy.ndarray): La imagen original en la que se aplicará la máscara.
     - mascara (numpy.ndarray): La máscara binaria.
-    - color (list): Color en formato RGB para aplicar en las áreas de la máscara.
+    - color (list): Color en el mismo formato que la imagen (BGR) para aplicar en las áreas de la máscara.
 
     Retorna:
     - numpy.ndarray: Imagen donde el área de la máscara se ha coloreado con el color especificado. """
-    coloreado_mascara = cv2.bitwise_and(image, image, mask=mascara)  # Aplicar la máscara
+    coloreado_mascara = np.zeros_like(image)  # Fondo negro fuera de la máscara
     coloreado_mascara[mascara > 0] = color  # Asignar color a las áreas enmascaradas
     return coloreado_mascara
 
@@ -66,92 +85,83 @@ def calculo_porcentaje_de_color(mascara, total_area):
 
     Retorna:
     - float: Porcentaje del área de la imagen cubierta por el color. """
-    area = np.sum(mascara == 255)  # Cuenta los píxeles blancos en la máscara
+    area = cv2.countNonZero(mascara)  # Cuenta los píxeles blancos en la máscara sin crear arreglos temporales
     return (area / total_area) * 100  # Calcula el porcentaje
 
+def crear_mascaras_de_colores(cuadro_en_HSV):
+    """ Crea las máscaras de todos los colores definidos en RANGOS_DE_COLOR.
+
+    Cuando un color tiene varios rangos, sus máscaras se unen sobre la primera, sin
+    reservar una máscara adicional para el resultado.
+
+    Parámetros:
+    - cuadro_en_HSV (numpy.ndarray): La imagen, ya convertida a HSV.
+
+    Retorna:
+    - list: Máscaras binarias en el mismo orden que RANGOS_DE_COLOR. """
+    mascaras = []
+    for _, rangos, _ in RANGOS_DE_COLOR:
+        (suave_color, alto_color), *otros_rangos = rangos
+        mascara = crear_mascara_de_color(cuadro_en_HSV, suave_color, alto_color)
+        for suave_color, alto_color in otros_rangos:
+            mascara_rango = crear_mascara_de_color(cuadro_en_HSV, suave_color, alto_color)
+            cv2.bitwise_or(mascara, mascara_rango, dst=mascara)  # Unir el rango en la misma máscara
+        mascaras.append(mascara)
+    return mascaras
+
+def calculo_porcentajes_de_colores(cuadro_en_HSV):
+    """ Calcula el porcentaje de área de cada color definido en RANGOS_DE_COLOR.
+
+    Parámetros:
+    - cuadro_en_HSV (numpy.ndarray): La imagen, ya convertida a HSV.
+
+    Retorna:
+    - list: Porcentajes de área en el mismo orden que RANGOS_DE_COLOR. """
+    total_area = cuadro_en_HSV.shape[0] * cuadro_en_HSV.shape[1]  # Calcular el área total en píxeles
+    mascaras = crear_mascaras_de_colores(cuadro_en_HSV)
+    return [calculo_porcentaje_de_color(mascara, total_area) for mascara in mascaras]
+
 def main():
     """ Función principal que ejecuta el proceso de detección de colores.
 
     Carga una imagen, define los rangos de colores, crea las máscaras para cada color,
     aplica las máscaras a la imagen, calcula el porcentaje de área para cada color y
-    visualiza los resultados mediante subplots. """
+    visualiza los resultados en un mosaico de OpenCV. """
     # Cargar la imagen desde el disco
     image = cv2.imread('D:/Documentos/Python/Proyectos/Workspaces/DatasetSuper/PruebasImg/Muestra167_3_jpg.rf.4fd529a06dee9e5bc2b7fc74b3eaef0a.jpg')
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convertir a RGB para visualización
-    total_area = image.shape[0] * image.shape[1]  # Calcular el área total en píxeles
-
-    # Definir rangos de colores en el espacio HSV
-    suave_rojo_bajo = np.array([0, 50, 50])
-    alto_rojo_bajo = np.array([10, 255, 255])
-    suave_rojo_alto = np.array([120, 50, 50])
-    alto_rojo_alto = np.array([180, 255, 255])
-    suave_verde = np.array([34, 50, 50])
-    alto_verde = np.array([90, 255, 255])
-    suave_amarillo = np.array([11, 50, 50])
-    alto_amarillo = np.array([33, 255, 255])
-
-    # Crear máscaras de color para cada rango definido
-    rojo_bajo_mascara = crear_mascara_de_color(image, suave_rojo_bajo, alto_rojo_bajo)
-    rojo_alto_mascara = crear_mascara_de_color(image, suave_rojo_alto, alto_rojo_alto)
-    verde_mascara = crear_mascara_de_color(image, suave_verde, alto_verde)
-    amarillo_mascara = crear_mascara_de_color(image, suave_amarillo, alto_amarillo)
-
-    # Aplicar las máscaras a la imagen y colorear las áreas
-    rojo_coloreado_bajo = aplicacion_de_mascara(image_rgb, rojo_bajo_mascara, [255, 0, 0])
-    rojo_coloreado_alto = aplicacion_de_mascara(image_rgb, rojo_alto_mascara, [255, 0, 0])
-    verde_coloreado = aplicacion_de_mascara(image_rgb, verde_mascara, [0, 255, 0])
-    amarillo_coloreado = aplicacion_de_mascara(image_rgb, amarillo_mascara, [255, 255, 0])
-
-    # Calcular el porcentaje de área cubierta por cada color
-    rojo_porciento_bajo = calculo_porcentaje_de_color(rojo_bajo_mascara, total_area)
-    rojo_porciento_alto = calculo_porcentaje_de_color(rojo_alto_mascara, total_area)
-    verde_porciento = calculo_porcentaje_de_color(verde_mascara, total_area)
-    amarillo_porciento = calculo_porcentaje_de_color(amarillo_mascara, total_area)
-
-    # Imprimir los porcentajes de cada color
-    print(f'rojo bajo: {rojo_porciento_bajo:.2f}%')
-    print(f'rojo alto: {rojo_porciento_alto:.2f}%')
-    print(f'verde: {verde_porciento:.2f}%')
-    print(f'amarillo: {amarillo_porciento:.2f}%')
-
-    # Configuración de visualización para mostrar las máscaras y áreas coloreadas
-    fig, axs = plt.subplots(4, 2, figsize=(10, 15))
-
-    # Mostrar cada máscara y su correspondiente imagen coloreada en el subplot
-    axs[0, 0].imshow(rojo_bajo_mascara, cmap='gray')
-    axs[0, 0].set_title('rojo bajo mascara')
-    axs[0, 0].axis('off')
-
-    axs[0, 1].imshow(rojo_coloreado_bajo)
-    axs[0, 1].set_title('rojo bajo coloreado')
-    axs[0, 1].axis('off')
-
-    axs[1, 0].imshow(rojo_alto_mascara, cmap='gray')
-    axs[1, 0].set_title('rojo alto mascara')
-    axs[1, 0].axis('off')
-
-    axs[1, 1].imshow(rojo_coloreado_alto)
-    axs[1, 1].set_title('rojo alto coloreado')
-    axs[1, 1].axis('off')
-
-    axs[2, 0].imshow(amarillo_mascara, cmap='gray')
-    axs[2, 0].set_title('amarillo mascara')
-    axs[2, 0].axis('off')
-
-    axs[2, 1].imshow(amarillo_coloreado)
-    axs[2, 1].set_title('amarillo coloreado')
-    axs[2, 1].axis('off')
-
-    axs[3, 0].imshow(verde_mascara, cmap='gray')
-    axs[3, 0].set_title('verde mascara')
-    axs[3, 0].axis('off')
-
-    axs[3, 1].imshow(verde_coloreado)
-    axs[3, 1].set_title('verde coloreado')
-    axs[3, 1].axis('off')
-
-    plt.tight_layout()
-    plt.show()
+    image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)  # Convertir a HSV una sola vez para todos los colores
+
+    # Calcular e imprimir el porcentaje de área cubierta por cada color
+    porcentajes = calculo_porcentajes_de_colores(image_hsv)
+    for (nombre, _, _), porcentaje in zip(RANGOS_DE_COLOR, porcentajes):
+        print(f'{nombre}: {porcentaje:.2f}%')
+
+    # Reducir la imagen para la visualización; los porcentajes ya se calcularon a resolución completa
+    escala = min(1.0, LADO_MAXIMO_VISUALIZACION / max(image.shape[:2]))
+    image_pequena = cv2.resize(image, (0, 0), fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    image_hsv = cv2.cvtColor(image_pequena, cv2.COLOR_BGR2HSV)
+
+    # Recalcular las máscaras sobre la imagen reducida para mostrarlas
+    mascaras = crear_mascaras_de_colores(image_hsv)
+
+    # Armar una fila del mosaico por color: la máscara y su correspondiente imagen coloreada
+    filas = []
+    for (nombre, _, color), mascara in zip(RANGOS_DE_COLOR, mascaras):
+        mascara_bgr = cv2.cvtColor(mascara, cv2.COLOR_GRAY2BGR)  # Tres canales para unirla con la imagen coloreada
+        coloreado = aplicacion_de_mascara(image_pequena, mascara, color)  # Colorear el área de la máscara
+        cv2.putText(mascara_bgr, f'{nombre} mascara', (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.putText(coloreado, f'{nombre} coloreado', (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        filas.append(np.hstack([mascara_bgr, coloreado]))
+
+    # Mostrar todas las máscaras y áreas coloreadas en una sola ventana. WINDOW_NORMAL permite
+    # que el mosaico se ajuste a la pantalla aunque sea más alto que ella.
+    mosaico = np.vstack(filas)
+    escala_ventana = min(1.0, ALTO_MAXIMO_MOSAICO / mosaico.shape[0])  # Tamaño inicial que cabe en pantalla
+    cv2.namedWindow('Mascaras de color', cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)
+    cv2.resizeWindow('Mascaras de color', int(mosaico.shape[1] * escala_ventana), int(mosaico.shape[0] * escala_ventana))
+    cv2.imshow('Mascaras de color', mosaico)
+    cv2.waitKey(0)
+    cv2.destroyAllWindows()
 
 if __name__ == '__main__':
     main()
@@ -25,22 +25,56 @@ Created on Mon Oct 01 2024
 
 @author: Carlos Ordoñez '''
 
+import os
 import cv2
 import time
+import queue
 import serial
 import numpy as np
-from collections import deque
+from collections import Counter, deque
+
+# Hilos que usa TensorFlow dentro de cada operación. Para lotes pequeños en CPU conviene
+# limitarlos a los núcleos físicos (se estima la mitad de los lógicos, por hyperthreading);
+# ajústalo experimentalmente según el equipo de inferencia.
+HILOS_INFERENCIA = max(1, (os.cpu_count() or 2) // 2)
+os.environ.setdefault('OMP_NUM_THREADS', str(HILOS_INFERENCIA))  # Debe definirse antes de importar TensorFlow
+
+import tensorflow as tf
 from tensorflow.keras.models import load_model
 import threading  # Para manejar la recepción de datos en un hilo separado
 
+# Fijar los hilos de TensorFlow antes de inicializar el runtime al cargar el modelo
+tf.config.threading.set_intra_op_parallelism_threads(HILOS_INFERENCIA)
+tf.config.threading.set_inter_op_parallelism_threads(1)
+
 # Cargar el modelo entrenado de clasificación de tomates
 model = load_model('D:/Clasificadora/Code/Proyectos/Workspaces/TomatoClass.keras')
 
+@tf.function
+def inferencia(input_img):
+    ''' Ejecuta el modelo en modo inferencia dentro de un grafo de TensorFlow.
+    Evita la sobrecarga de model.predict, pensado para conjuntos de datos grandes y no
+    para unos pocos frames por llamada. Recibe los píxeles en uint8 y los normaliza entre
+    0 y 1 dentro del grafo, de modo que TensorFlow puede fusionar la normalización con la
+    primera capa y el tensor de entrada ocupa la cuarta parte que en float32. '''
+    return model(tf.cast(input_img, tf.float32) / 255.0, training=False)
+
+# Número de frames que se agrupan en cada llamada al modelo. Agrupar reparte el costo fijo
+# de cada llamada entre varios frames a cambio de un poco más de latencia; en CPU suelen
+# funcionar valores entre 2 y 8, según el equipo. El hilo de captura llena el siguiente
+# batch mientras el modelo procesa el actual.
+TAMANO_LOTE = 4
+
+# Trazar el grafo una sola vez para la forma de entrada fija (TAMANO_LOTE imágenes de 224x224x3)
+infer = inferencia.get_concrete_function(tf.TensorSpec([TAMANO_LOTE, 224, 224, 3], tf.uint8))
+
 # Inicializar la captura de video desde la cámara principal del sistema
 cap = cv2.VideoCapture(0)
+cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Evita que el driver acumule frames atrasados
 
 # Inicializar la conexión serial con el Arduino en el puerto COM6
-ser = serial.Serial('COM6', 9600, timeout=1)  # Ajusta el puerto según sea necesario
+# Sin timeout, la lectura bloquea el hilo del Arduino hasta recibir una línea completa
+ser = serial.Serial('COM6', 9600, timeout=None)  # Ajusta el puerto según sea necesario
 time.sleep(2)  # Espera 2 segundos para asegurar que la conexión se establezca
 
 # Configuración de las colas para almacenar las últimas cinco predicciones
@@ -49,103 +83,197 @@ coincidencia_minima = 4    # Número mínimo de coincidencias necesarias para un
 fila_predicciones = deque(maxlen=coincidencia_maxima)  # Cola para predicciones de clase
 fila_confianza = deque(maxlen=coincidencia_maxima)   # Cola para niveles de confianza
 fila_de_tiempos = deque(maxlen=coincidencia_maxima)        # Cola para tiempos de predicción
+conteo_clases = Counter()  # Número de apariciones de cada clase en fila_predicciones
 mandar_confirmacion = False  # Flag para controlar el envío de datos
 
+# Buffer del batch reservado una sola vez y reutilizado en cada llamada al modelo
+input_img = np.empty((TAMANO_LOTE, 224, 224, 3), dtype=np.uint8)  # Batch de frames redimensionados
+
+# Detección de cambios en la escena para no repetir la inferencia sobre frames casi iguales
+UMBRAL_CAMBIO_ESCENA = 4.0  # Diferencia absoluta media (0-255) a partir de la cual se vuelve a inferir
+miniaturas = np.empty((TAMANO_LOTE, 32, 32, 3), dtype=np.uint8)  # Miniaturas de los frames del batch
+miniatura_referencia = None  # Miniatura del último frame que pasó por el modelo
+predictions = None  # Últimas predicciones del modelo, reutilizadas mientras la escena no cambie
+
 def lectura_de_arduino():
     ''' Función que lee datos desde el puerto serial del Arduino de forma continua en un hilo separado.
     Este hilo permite recibir datos del encoder en tiempo real sin interrumpir el flujo principal.
     Imprime en consola los mensajes recibidos del Arduino. '''
     global mandar_confirmacion
     while True:
-        if ser.in_waiting > 0:  # Verifica si hay datos disponibles en el puerto serial
+        try:
+            # Espera bloqueado, sin consumir CPU, hasta que llegue una línea del Arduino
             line = ser.readline().decode('utf-8', errors='ignore').strip()  # Lee y decodifica la línea
-            print('Mensaje del Arduino:', line)  # Imprime el mensaje del Arduino en la consola
-            if line == 'ok':
-                mandar_confirmacion = True  # Arduino está listo para recibir datos
+        except serial.SerialException:
+            break  # El puerto se cerró al finalizar el programa
+        print('Mensaje del Arduino:', line)  # Imprime el mensaje del Arduino en la consola
+        if line == 'ok':
+            mandar_confirmacion = True  # Arduino está listo para recibir datos
 
 # Crear e iniciar el hilo de lectura del Arduino
 arduino_thread = threading.Thread(target=lectura_de_arduino)
 arduino_thread.daemon = True  # Esto asegura que el hilo termine cuando el script principal termine
 arduino_thread.start()  # Inicia el hilo de lectura del Arduino
 
-while True:
-    # Captura un frame de la cámara
-    ret, frame = cap.read()
-    if not ret:  # Si no se pudo capturar el frame, sale del bucle
+# Cola de mensajes pendientes de enviar al Arduino; None indica el fin del envío
+fila_envio = queue.Queue()
+
+# Mensajes para el Arduino codificados una sola vez, para no crearlos en cada envío
+MENSAJES_CLASE = {clase: f'{clase}\n'.encode() for clase in range(10)}  # Clase confirmada
+MENSAJE_NO_IDENTIFICADO = b'3'  # Predicción no confiable
+
+def escritura_a_arduino():
+    ''' Función que envía al Arduino los mensajes de fila_envio en un hilo separado.
+    Así la escritura serial, que bloquea hasta que el puerto acepta los datos, no detiene
+    el bucle de inferencia. '''
+    while True:
+        mensaje = fila_envio.get()
+        if mensaje is None:
+            break
+        ser.write(mensaje)
+
+# Crear e iniciar el hilo de escritura al Arduino
+escritura_thread = threading.Thread(target=escritura_a_arduino)
+escritura_thread.daemon = True
+escritura_thread.start()
+
+# Estado compartido entre el hilo de captura y el bucle principal
+frames_recientes = deque(maxlen=TAMANO_LOTE)  # Últimos frames capturados; los anteriores se descartan
+frame_lock = threading.Lock()          # Protege el acceso a frames_recientes
+frame_disponible = threading.Event()   # Indica que hay un batch completo de frames nuevos
+detener = threading.Event()            # Señal de finalización para el hilo de captura
+
+def captura_de_camara():
+    ''' Función que captura frames de la cámara de forma continua en un hilo separado.
+    Conserva los TAMANO_LOTE frames más recientes, de modo que el siguiente batch se reúne
+    mientras el bucle principal ejecuta la inferencia y nunca se procesan frames atrasados. '''
+    while not detener.is_set():
+        ret, frame = cap.read()
+        if not ret:  # Si no se pudo capturar el frame, se detiene el programa
+            detener.set()
+            break
+        with frame_lock:
+            frames_recientes.append(frame)
+            if len(frames_recientes) == TAMANO_LOTE:
+                frame_disponible.set()
+    frame_disponible.set()  # Despierta al bucle principal para que pueda terminar
+
+# Crear e iniciar el hilo de captura de la cámara
+captura_thread = threading.Thread(target=captura_de_camara)
+captura_thread.daemon = True
+captura_thread.start()
+
+salir = False  # Se activa al presionar ESC
+while not salir:
+    # Tomar el batch de TAMANO_LOTE frames nuevos que reunió el hilo de captura
+    frame_disponible.wait()
+    if detener.is_set():  # Si no se pudo capturar el frame, sale del bucle
         break
+    with frame_lock:
+        frames_lote = list(frames_recientes)
+        frames_recientes.clear()
+        frame_disponible.clear()
+
+    for indice, frame in enumerate(frames_lote):
+        # Preprocesamiento de la imagen; la normalización se hace dentro del modelo
+        # Se usa la interpolación por defecto (INTER_LINEAR), la misma con la que se entrenó el modelo
+        cv2.resize(frame, (224, 224), dst=input_img[indice])  # Redimensiona al tamaño de entrada del modelo
+        cv2.resize(input_img[indice], (32, 32), dst=miniaturas[indice], interpolation=cv2.INTER_AREA)  # Miniatura para detectar cambios
 
     start_time = time.time()  # Inicia el temporizador para medir el tiempo de predicción
 
-    # Preprocesamiento de la imagen antes de pasarla al modelo
-    input_img = cv2.resize(frame, (224, 224))  # Redimensiona la imagen al tamaño de entrada del modelo
-    input_img = input_img.astype(np.float32) / 255.0  # Normaliza los valores de los píxeles entre 0 y 1
-    input_img = np.expand_dims(input_img, axis=0)  # Añade una dimensión extra para formar un batch
+    # Comprobar si algún frame del batch cambió respecto al último frame evaluado por el modelo
+    escena_cambio = miniatura_referencia is None or max(
+        cv2.absdiff(miniatura, miniatura_referencia).mean() for miniatura in miniaturas
+    ) >= UMBRAL_CAMBIO_ESCENA
 
-    # Realizar la predicción usando el modelo cargado
-    predictions = model.predict(input_img)
+    if escena_cambio:
+        # Realizar la predicción de todo el batch con una sola llamada al modelo
+        predictions = [salida.numpy() for salida in infer(tf.constant(input_img))]
+        miniatura_referencia = miniaturas[-1].copy()
+    else:
+        # La escena no cambió: todos los frames reutilizan la última predicción del modelo
+        predictions = [np.repeat(salida[-1:], TAMANO_LOTE, axis=0) for salida in predictions]
 
     # Medir el tiempo después de la predicción
     end_time = time.time()
-    prediction_time = end_time - start_time  # Calcula el tiempo total de predicción
-
-    # Extrae la clase predicha y los valores del bounding box
-    prediccion_de_clase = np.argmax(predictions[0][0])  # Índice de la clase con mayor probabilidad
-    prediccion_de_confianza = np.max(predictions[0][0])  # Confianza de la clase predicha
-    prediccion_de_bboxes = predictions[1][0]  # Coordenadas normalizadas del bounding box
-
-    # Desnormalizar las coordenadas del bounding box al tamaño real de la imagen
-    height, width, _ = frame.shape
-    xmin = int(prediccion_de_bboxes[0] * width)
-    ymin = int(prediccion_de_bboxes[1] * height)
-    xmax = int(prediccion_de_bboxes[2] * width)
-    ymax = int(prediccion_de_bboxes[3] * height)
-
-    # Guardar las últimas predicciones en las colas
-    fila_predicciones.append(prediccion_de_clase)
-    fila_confianza.append(prediccion_de_confianza)
-    fila_de_tiempos.append(prediction_time)
-
-    # Analizar las últimas cinco predicciones para determinar si se confirma una clase
-    if len(fila_predicciones) == coincidencia_maxima:
-        # Encuentra la clase más común en las últimas predicciones
-        clase_mas_comun = max(set(fila_predicciones), key=fila_predicciones.count)
-        recuento_clase_mas_comun = fila_predicciones.count(clase_mas_comun)
-
-        # Si la clase más común aparece al menos coincidencia_minima veces, se considera válida
-        if recuento_clase_mas_comun >= coincidencia_minima:
-            # Calcula la confianza y el tiempo promedio de las predicciones coincidentes
-            promedio_confidence = np.mean([conf for cls, conf in zip(fila_predicciones, fila_confianza) if cls == clase_mas_comun])
-            promedio_time = np.mean(fila_de_tiempos)
-            mensaje_prediccion = f'Detectado: Tomate {clase_mas_comun}, Confianza promedio: {promedio_confidence:.2f}, Tiempo promedio: {promedio_time:.2f}s'
-            print(f'El tipo de tomate es: {clase_mas_comun}')
-            # Solo envía datos si se recibió la confirmación "ok" de Arduino
-            if mandar_confirmacion:
-                ser.write((str(clase_mas_comun) + '\n').encode())  # Enviar la clase predicha al Arduino
-                mandar_confirmacion = False  # Restablece el permiso hasta recibir el próximo "ok"
-        else:
-            # Si la predicción no es confiable, envía un mensaje para "no identificado"
-            mensaje = 'No se identificó correctamente'
-            print('No reconocido')
-            if mandar_confirmacion:
-                ser.write('3'.encode())  # Enviar '3' para indicar "no identificado"
-                mandar_confirmacion = False
-
-        # Escribe el mensaje de predicción en el frame
-        cv2.putText(frame, mensaje_prediccion, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-    # Dibujar el bounding box y mostrar la etiqueta de clase en el frame
-    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
-    label = f'Tomate: {prediccion_de_clase}, Conf: {prediccion_de_confianza:.2f}'
-    cv2.putText(frame, label, (xmin, ymin - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-    # Mostrar el frame con el cuadro delimitador y la etiqueta en la ventana
-    cv2.imshow('Deteccion de Tomates', frame)
-
-    # Presionar ESC para salir
-    if cv2.waitKey(1) & 0xFF == 27:
-        break
+    prediction_time = (end_time - start_time) / TAMANO_LOTE  # Tiempo de predicción por frame
+
+    # Procesar cada frame del batch en orden de captura
+    for indice, frame in enumerate(frames_lote):
+        # Extrae la clase predicha y los valores del bounding box
+        prediccion_de_clase = np.argmax(predictions[0][indice])  # Índice de la clase con mayor probabilidad
+        prediccion_de_confianza = np.max(predictions[0][indice])  # Confianza de la clase predicha
+        prediccion_de_bboxes = predictions[1][indice]  # Coordenadas normalizadas del bounding box
+
+        # Desnormalizar las coordenadas del bounding box al tamaño real de la imagen
+        height, width, _ = frame.shape
+        xmin = int(prediccion_de_bboxes[0] * width)
+        ymin = int(prediccion_de_bboxes[1] * height)
+        xmax = int(prediccion_de_bboxes[2] * width)
+        ymax = int(prediccion_de_bboxes[3] * height)
+
+        # Guardar las últimas predicciones en las colas, actualizando el conteo de clases
+        if len(fila_predicciones) == coincidencia_maxima:
+            clase_descartada = fila_predicciones[0]  # La cola descartará esta predicción al agregar la nueva
+            conteo_clases[clase_descartada] -= 1
+            if conteo_clases[clase_descartada] == 0:
+                del conteo_clases[clase_descartada]
+        fila_predicciones.append(prediccion_de_clase)
+        conteo_clases[prediccion_de_clase] += 1
+        fila_confianza.append(prediccion_de_confianza)
+        if escena_cambio:  # Solo se promedian los tiempos de los batches que pasaron por el modelo
+            fila_de_tiempos.append(prediction_time)
+
+        # Analizar las últimas cinco predicciones para determinar si se confirma una clase
+        if len(fila_predicciones) == coincidencia_maxima:
+            # Encuentra la clase más común en las últimas predicciones
+            clase_mas_comun, recuento_clase_mas_comun = conteo_clases.most_common(1)[0]
+
+            # Si la clase más común aparece al menos coincidencia_minima veces, se considera válida
+            if recuento_clase_mas_comun >= coincidencia_minima:
+                # Calcula la confianza y el tiempo promedio de las predicciones coincidentes
+                # Con solo coincidencia_maxima valores, sum()/len() es más rápido que np.mean
+                confianzas_coincidentes = [conf for cls, conf in zip(fila_predicciones, fila_confianza) if cls == clase_mas_comun]
+                promedio_confidence = sum(confianzas_coincidentes) / len(confianzas_coincidentes)
+                promedio_time = sum(fila_de_tiempos) / len(fila_de_tiempos)
+                mensaje_prediccion = f'Detectado: Tomate {clase_mas_comun}, Confianza promedio: {promedio_confidence:.2f}, Tiempo promedio: {promedio_time:.2f}s'
+                print(f'El tipo de tomate es: {clase_mas_comun}')
+                # Solo envía datos si se recibió la confirmación "ok" de Arduino
+                if mandar_confirmacion:
+                    fila_envio.put(MENSAJES_CLASE[int(clase_mas_comun)])  # Enviar la clase predicha al Arduino
+                    mandar_confirmacion = False  # Restablece el permiso hasta recibir el próximo "ok"
+            else:
+                # Si la predicción no es confiable, envía un mensaje para "no identificado"
+                mensaje = 'No se identificó correctamente'
+                print('No reconocido')
+                if mandar_confirmacion:
+                    fila_envio.put(MENSAJE_NO_IDENTIFICADO)  # Enviar '3' para indicar "no identificado"
+                    mandar_confirmacion = False
+
+            # Escribe el mensaje de predicción en el frame
+            cv2.putText(frame, mensaje_prediccion, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+        # Dibujar el bounding box y mostrar la etiqueta de clase en el frame
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
+        label = f'Tomate: {prediccion_de_clase}, Conf: {prediccion_de_confianza:.2f}'
+        cv2.putText(frame, label, (xmin, ymin - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+        # Mostrar el frame con el cuadro delimitador y la etiqueta en la ventana
+        cv2.imshow('Deteccion de Tomates', frame)
+
+        # Presionar ESC para salir
+        if cv2.waitKey(1) & 0xFF == 27:
+            salir = True
+            break
+
+# Detener el hilo de captura antes de liberar la cámara
+detener.set()
+captura_thread.join()
 
 # Liberar la cámara y cerrar todas las ventanas al finalizar
 cap.release()
 cv2.destroyAllWindows()
+fila_envio.put(None)  # Termina el hilo de escritura tras enviar los mensajes pendientes
+escritura_thread.join()
 ser.close()